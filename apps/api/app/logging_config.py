@@ -1,11 +1,13 @@
 import logging
+import os
 from rich.logging import RichHandler
 
 
 def setup_logging():
     """Set up logging with RichHandler that shows file name & line number."""
     logging.basicConfig(
-        level="DEBUG",
+        # Set INSCRYPT_LOG_LEVEL=INFO in production to drop per-request debug output
+        level=os.environ.get("INSCRYPT_LOG_LEVEL", "DEBUG").upper(),
         # %(name)s = logger name (module path)
         # %(pathname)s:%(lineno)d = file & line
         format="[%(asctime)s] %(levelname)s %(pathname)s:%(lineno)d - %(message)s",
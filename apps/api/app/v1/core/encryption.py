@@ -1,8 +1,13 @@
 from __future__ import annotations
 
 import base64
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Tuple, Optional
 
+import msgpack
+from Crypto.Util import _cpu_features
 from Crypto.Cipher import AES, DES, DES3, ChaCha20, Blowfish, ARC2, ARC4, Salsa20, CAST
 from Crypto.Random import get_random_bytes
 from Crypto.Hash import (
@@ -26,6 +31,13 @@ from Crypto.Hash import (
     keccak,
 )
 
+from app.v1.core.errors import InvalidInputError
+
+# PyCryptodome dispatches to AES-NI/CLMUL by itself; probe once at import so
+# startup can report it and nothing on the request path re-detects
+HAS_AESNI = bool(_cpu_features.have_aes_ni())
+HAS_CLMUL = bool(_cpu_features.have_clmul())
+
 # --------------------------------------------------------------------------- #
 # Helpers                                                                     #
 # --------------------------------------------------------------------------- #
@@ -55,14 +67,16 @@ def _get_hash(name: str):
     try:
         return _HASH_MAP[name.lower()]
     except KeyError:
-        raise ValueError(f"Unsupported hash: {name}")
+        raise InvalidInputError(f"Unsupported hash: {name}")
 
 
-def _kdf(key_material: bytes, hash_name: str, size: int, index: int) -> bytes:
-    """Deterministically derive a key for layer *index*."""
-    h = _get_hash(hash_name)
-    data = key_material + str(index).encode()
-    if h in {
+# Key sizes in bytes; every other algorithm uses 16
+_KEY_SIZES = {"des": 8, "chacha20": 32, "salsa20": 32}
+
+
+# Hashes that are read as XOFs instead of truncating a fixed-size digest
+_XOF_HASHES = frozenset(
+    {
         SHAKE128,
         SHAKE256,
         cSHAKE128,
@@ -70,7 +84,14 @@ def _kdf(key_material: bytes, hash_name: str, size: int, index: int) -> bytes:
         KangarooTwelve,
         TupleHash128,
         TupleHash256,
-    }:
+    }
+)
+
+
+def _kdf(key_material: bytes, h, size: int, index: int) -> bytes:
+    """Deterministically derive a key for layer *index* using hash module *h*."""
+    data = key_material + str(index).encode()
+    if h in _XOF_HASHES:
         return h.new(data=data).read(size)
     return h.new(data=data).digest()[:size]
 
@@ -78,101 +99,120 @@ def _kdf(key_material: bytes, hash_name: str, size: int, index: int) -> bytes:
 # --------------------------------------------------------------------------- #
 # Per-algorithm wrappers                                                      #
 # --------------------------------------------------------------------------- #
-def _encrypt_layer(
-    algo: str, key: bytes, plaintext: bytes
-) -> Tuple[bytes, Dict[str, bytes]]:
-    """Return (ciphertext, meta-dict with nonce/tag when applicable)."""
-    algo = algo.lower()
-
-    if algo == "aes":
-        cipher = AES.new(key, AES.MODE_EAX)
+def _eax_encryptor(module):
+    def encrypt(key: bytes, plaintext: bytes) -> Tuple[bytes, Dict[str, bytes]]:
+        cipher = module.new(key, module.MODE_EAX)
         ct, tag = cipher.encrypt_and_digest(plaintext)
         return ct, {"nonce": cipher.nonce, "tag": tag}
 
-    if algo == "des":
-        cipher = DES.new(key, DES.MODE_EAX)
-        ct, tag = cipher.encrypt_and_digest(plaintext)
-        return ct, {"nonce": cipher.nonce, "tag": tag}
+    return encrypt
 
-    if algo == "des3":
-        cipher = DES3.new(key, DES3.MODE_EAX)
-        ct, tag = cipher.encrypt_and_digest(plaintext)
-        return ct, {"nonce": cipher.nonce, "tag": tag}
 
-    if algo == "blowfish":
-        cipher = Blowfish.new(key, Blowfish.MODE_EAX)
-        ct, tag = cipher.encrypt_and_digest(plaintext)
-        return ct, {"nonce": cipher.nonce, "tag": tag}
+def _eax_decryptor(module):
+    def decrypt(key: bytes, ciphertext: bytes, meta: Dict[str, bytes]) -> bytes:
+        cipher = module.new(key, module.MODE_EAX, nonce=meta["nonce"])
+        return cipher.decrypt_and_verify(ciphertext, meta["tag"])
 
-    if algo == "arc2":
-        cipher = ARC2.new(key, ARC2.MODE_EAX)
-        ct, tag = cipher.encrypt_and_digest(plaintext)
-        return ct, {"nonce": cipher.nonce, "tag": tag}
+    return decrypt
 
-    if algo == "cast":
-        cipher = CAST.new(key, CAST.MODE_EAX)
-        ct, tag = cipher.encrypt_and_digest(plaintext)
-        return ct, {"nonce": cipher.nonce, "tag": tag}
 
-    # --- stream ciphers ---------------------------------------------------- #
-    if algo == "chacha20":
-        cipher = ChaCha20.new(key=key)
-        return cipher.encrypt(plaintext), {"nonce": cipher.nonce}
+# --- AES ------------------------------------------------------------------ #
+# GCM runs CTR and GHASH on AES-NI/CLMUL in parallel, unlike EAX's serial CMAC.
+# Its 12-byte nonce also tells new codebooks apart from older EAX ones (16).
+_GCM_NONCE_SIZE = 12
+
 
-    if algo == "salsa20":
-        cipher = Salsa20.new(key=key)
+def _aes_encrypt(key: bytes, plaintext: bytes) -> Tuple[bytes, Dict[str, bytes]]:
+    nonce = get_random_bytes(_GCM_NONCE_SIZE)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    ct, tag = cipher.encrypt_and_digest(plaintext)
+    return ct, {"nonce": nonce, "tag": tag}
+
+
+def _aes_decrypt(key: bytes, ciphertext: bytes, meta: Dict[str, bytes]) -> bytes:
+    nonce = meta["nonce"]
+    mode = AES.MODE_GCM if len(nonce) == _GCM_NONCE_SIZE else AES.MODE_EAX
+    cipher = AES.new(key, mode, nonce=nonce)
+    return cipher.decrypt_and_verify(ciphertext, meta["tag"])
+
+
+# --- stream ciphers -------------------------------------------------------- #
+def _stream_encryptor(module):
+    def encrypt(key: bytes, plaintext: bytes) -> Tuple[bytes, Dict[str, bytes]]:
+        cipher = module.new(key=key)
         return cipher.encrypt(plaintext), {"nonce": cipher.nonce}
 
-    if algo == "arc4":
-        cipher = ARC4.new(key)
-        return cipher.encrypt(plaintext), {}
+    return encrypt
 
-    raise ValueError(f"Unsupported algorithm: {algo}")
 
+def _stream_decryptor(module):
+    def decrypt(key: bytes, ciphertext: bytes, meta: Dict[str, bytes]) -> bytes:
+        cipher = module.new(key=key, nonce=meta["nonce"])
+        return cipher.decrypt(ciphertext)
 
-def _decrypt_layer(
-    algo: str, key: bytes, ciphertext: bytes, meta: Dict[str, bytes]
-) -> bytes:
-    """Inverse of _encrypt_layer."""
-    algo = algo.lower()
+    return decrypt
 
-    if algo == "aes":
-        cipher = AES.new(key, AES.MODE_EAX, nonce=meta["nonce"])
-        return cipher.decrypt_and_verify(ciphertext, meta["tag"])
 
-    if algo == "des":
-        cipher = DES.new(key, DES.MODE_EAX, nonce=meta["nonce"])
-        return cipher.decrypt_and_verify(ciphertext, meta["tag"])
+def _arc4_encrypt(key: bytes, plaintext: bytes) -> Tuple[bytes, Dict[str, bytes]]:
+    return ARC4.new(key).encrypt(plaintext), {}
 
-    if algo == "des3":
-        cipher = DES3.new(key, DES3.MODE_EAX, nonce=meta["nonce"])
-        return cipher.decrypt_and_verify(ciphertext, meta["tag"])
 
-    if algo == "blowfish":
-        cipher = Blowfish.new(key, Blowfish.MODE_EAX, nonce=meta["nonce"])
-        return cipher.decrypt_and_verify(ciphertext, meta["tag"])
+def _arc4_decrypt(key: bytes, ciphertext: bytes, meta: Dict[str, bytes]) -> bytes:
+    return ARC4.new(key).decrypt(ciphertext)
 
-    if algo == "arc2":
-        cipher = ARC2.new(key, ARC2.MODE_EAX, nonce=meta["nonce"])
-        return cipher.decrypt_and_verify(ciphertext, meta["tag"])
 
-    if algo == "cast":
-        cipher = CAST.new(key, CAST.MODE_EAX, nonce=meta["nonce"])
-        return cipher.decrypt_and_verify(ciphertext, meta["tag"])
+_ENCRYPTORS = {
+    "aes": _aes_encrypt,
+    "des": _eax_encryptor(DES),
+    "des3": _eax_encryptor(DES3),
+    "blowfish": _eax_encryptor(Blowfish),
+    "arc2": _eax_encryptor(ARC2),
+    "cast": _eax_encryptor(CAST),
+    "chacha20": _stream_encryptor(ChaCha20),
+    "salsa20": _stream_encryptor(Salsa20),
+    "arc4": _arc4_encrypt,
+}
 
-    if algo == "chacha20":
-        cipher = ChaCha20.new(key=key, nonce=meta["nonce"])
-        return cipher.decrypt(ciphertext)
+_DECRYPTORS = {
+    "aes": _aes_decrypt,
+    "des": _eax_decryptor(DES),
+    "des3": _eax_decryptor(DES3),
+    "blowfish": _eax_decryptor(Blowfish),
+    "arc2": _eax_decryptor(ARC2),
+    "cast": _eax_decryptor(CAST),
+    "chacha20": _stream_decryptor(ChaCha20),
+    "salsa20": _stream_decryptor(Salsa20),
+    "arc4": _arc4_decrypt,
+}
 
-    if algo == "salsa20":
-        cipher = Salsa20.new(key=key, nonce=meta["nonce"])
-        return cipher.decrypt(ciphertext)
 
-    if algo == "arc4":
-        cipher = ARC4.new(key)
-        return cipher.decrypt(ciphertext)
+def _encrypt_layer(
+    algo: str, key: bytes, plaintext: bytes
+) -> Tuple[bytes, Dict[str, bytes]]:
+    """Return (ciphertext, meta-dict with nonce/tag when applicable).
 
-    raise ValueError(f"Unsupported algorithm: {algo}")
+    *algo* must already be lower-cased by the caller.
+    """
+    try:
+        encrypt = _ENCRYPTORS[algo]
+    except KeyError:
+        raise InvalidInputError(f"Unsupported algorithm: {algo}")
+    return encrypt(key, plaintext)
+
+
+def _decrypt_layer(
+    algo: str, key: bytes, ciphertext: bytes, meta: Dict[str, bytes]
+) -> bytes:
+    """Inverse of _encrypt_layer."""
+    try:
+        decrypt = _DECRYPTORS[algo]
+    except KeyError:
+        raise InvalidInputError(f"Unsupported algorithm: {algo}")
+    try:
+        return decrypt(key, ciphertext, meta)
+    except (ValueError, KeyError, TypeError):
+        # MAC check failures and missing or malformed nonces and tags
+        raise InvalidInputError("Decryption failed: wrong password or corrupted data")
 
 
 # --------------------------------------------------------------------------- #
@@ -182,68 +222,100 @@ def encrypt_data(
     data: bytes, password: str, encryption_layers: List[str], hash_name: str
 ) -> Dict[str, Any]:
     key_material = password.encode()
+    h = _get_hash(hash_name)
     current = data
 
-    nonces: Dict[str, str] = {}
-    tags: Dict[str, str] = {}
-    meta_store: Dict[str, Dict[str, str]] = {"nonces": {}, "tags": {}}
+    nonces: Dict[str, bytes] = {}
+    tags: Dict[str, bytes] = {}
 
-    for idx, algo in enumerate(encryption_layers):
-        key_size = {"des": 8}.get(algo.lower(), 16)  # 16 bytes default
-        if algo.lower() in {"chacha20", "salsa20"}:
-            key_size = 32
-
-        key = _kdf(key_material, hash_name, key_size, idx)
+    for idx, layer in enumerate(encryption_layers):
+        algo = layer.lower()
+        key = _kdf(key_material, h, _KEY_SIZES.get(algo, 16), idx)
         ct, meta = _encrypt_layer(algo, key, current)
 
-        key_name = f"{algo}_{idx}"
+        # Codebook entries keep the caller's spelling of the layer name
+        key_name = f"{layer}_{idx}"
         if "nonce" in meta:
-            nonces[key_name] = base64.b64encode(meta["nonce"]).decode()
+            nonces[key_name] = meta["nonce"]
         if "tag" in meta:
-            tags[key_name] = base64.b64encode(meta["tag"]).decode()
+            tags[key_name] = meta["tag"]
 
         current = ct  # feed into next layer
 
     return {
-        "encrypted_data": base64.b64encode(current).decode(),
-        "codebook": {
-            "hash": hash_name,
-            "layers": encryption_layers,
-            "nonces": nonces,
-            "tags": tags,
-        },
+        # Raw ciphertext: it is hidden as bytes, so a text encoding would only
+        # inflate the payload
+        "encrypted_data": current,
+        # Nonces and tags stay raw bytes inside a compact msgpack blob
+        "codebook": msgpack.packb(
+            {
+                "hash": hash_name,
+                "layers": encryption_layers,
+                "nonces": nonces,
+                "tags": tags,
+            },
+            use_bin_type=True,
+        ),
     }
 
 
+def encrypt_data_many(
+    items: List[Tuple[bytes, str, List[str], str]],
+) -> List[Dict[str, Any]]:
+    """Encrypt independent ``(data, password, layers, hash_name)`` jobs concurrently.
+
+    Layers within one job feed each other and must stay sequential, but separate
+    jobs share no state and PyCryptodome drops the GIL inside its C primitives,
+    so they spread across a thread pool. Results keep the order of *items*.
+    """
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        return list(pool.map(lambda item: encrypt_data(*item), items))
+
+
+def _load_codebook(codebook: bytes) -> Dict[str, Any]:
+    """Parse a msgpack codebook, or a JSON one with base64 nonces and tags.
+
+    The JSON form is what files embedded before the msgpack codebook carry. A
+    msgpack map never starts with ``{`` (0x7b is a positive fixint).
+    """
+    if codebook[:1] != b"{":
+        return msgpack.unpackb(codebook, raw=False)
+    unpacked = json.loads(codebook)
+    for field in ("nonces", "tags"):
+        unpacked[field] = {
+            k: base64.b64decode(v) for k, v in unpacked.get(field, {}).items()
+        }
+    return unpacked
+
+
 def decrypt_data(
     encrypted_data: bytes,
     password: str,
-    codebook: Dict[str, Any],
+    codebook: bytes,
 ) -> bytes:
-    layers = codebook["layers"]
-    hash_name = codebook["hash"]
-    nonces_b64 = codebook.get("nonces", {})
-    tags_b64 = codebook.get("tags", {})
-
-    # Decode base64 metadata once
-    nonces = {k: base64.b64decode(v) for k, v in nonces_b64.items()}
-    tags = {k: base64.b64decode(v) for k, v in tags_b64.items()}
+    try:
+        unpacked = _load_codebook(codebook)
+        layers = unpacked["layers"]
+        hash_name = unpacked["hash"]
+        nonces = unpacked.get("nonces", {})
+        tags = unpacked.get("tags", {})
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise InvalidInputError("A codebook with 'layers' and 'hash' is required")
 
     key_material = password.encode()
+    h = _get_hash(hash_name)
     current = encrypted_data
 
     # ------------------------------------------------------------------ #
     # Decrypt layers in reverse order                                    #
     # ------------------------------------------------------------------ #
-    for idx, algo in reversed(list(enumerate(layers))):
-        key_size = {"des": 8}.get(algo.lower(), 16)
-        if algo.lower() in {"chacha20", "salsa20"}:
-            key_size = 32
-
-        key = _kdf(key_material, hash_name, key_size, idx)
+    for idx in range(len(layers) - 1, -1, -1):
+        layer = layers[idx]
+        algo = layer.lower()
+        key = _kdf(key_material, h, _KEY_SIZES.get(algo, 16), idx)
 
         # Use unique keys per layer to avoid collisions
-        key_name = f"{algo}_{idx}"
+        key_name = f"{layer}_{idx}"
         meta: Dict[str, bytes] = {}
         if key_name in nonces:
             meta["nonce"] = nonces[key_name]
@@ -0,0 +1,7 @@
+class InvalidInputError(ValueError):
+    """
+    Raised for failures caused by the uploaded file or form fields: unreadable
+    covers, covers too small for the payload, unknown algorithms and wrong
+    passwords. Messages are fixed text that is safe to return to clients; any
+    other exception is treated as an internal error.
+    """
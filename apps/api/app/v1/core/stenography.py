@@ -1,14 +1,23 @@
 import numpy as np
 import os
+import tempfile
+from contextlib import closing
+from queue import Empty, Queue
+import threading
 from PIL import Image
-from typing import Optional, Tuple
+from typing import IO, Iterable, Iterator, Optional, Tuple, Union
 import cv2
-from moviepy import ImageSequenceClip, VideoFileClip
+from moviepy.config import FFMPEG_BINARY
+from moviepy.tools import subprocess_call
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
 import soundfile as sf
-from scipy.signal import fftconvolve
+from scipy.fft import rfft, irfft
+
+from app.v1.core.errors import InvalidInputError
 
 try:
     from pydub import AudioSegment
+    from pydub.exceptions import CouldntDecodeError
 
     # Check for FFMPEG_PATH environment variable
     if "FFMPEG_PATH" in os.environ:
@@ -17,73 +26,182 @@ try:
 except ImportError:
     _HAS_PYDUB = False
 
+try:
+    import av
+
+    _HAS_AV = True
+except ImportError:
+    _HAS_AV = False
+
+try:
+    from numba import njit
+
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+try:
+    import cupy as cp
+
+    try:
+        _HAS_CUPY = cp.cuda.runtime.getDeviceCount() > 0
+    except cp.cuda.runtime.CUDARuntimeError:
+        _HAS_CUPY = False
+except ImportError:
+    _HAS_CUPY = False
+
 
 # Magic number to identify our steganographic data
 STEGO_MAGIC = b"INSCRYPT_STEGO"
 
+# Lower-cased techniques the hide/extract wrappers below dispatch on, per media
+# kind; anything else raises before any work is done
+IMPLEMENTED_TECHNIQUES = {
+    "image": frozenset({"lsb"}),
+    "audio": frozenset({"lsb", "echohiding", "phasecoding"}),
+    "video": frozenset({"lsb", "motionvector"}),
+}
+
+
+def _bytes_to_bits(data) -> np.ndarray:
+    """Unpack bytes into a uint8 array of 0/1 values, most significant bit first."""
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+
+def _bits_to_bytes(bits: np.ndarray) -> bytes:
+    """Pack 0/1 values back into bytes, dropping a trailing partial byte."""
+    return np.packbits(bits[: bits.size - bits.size % 8]).tobytes()
+
+
+def _stego_payload(message: bytes, len_bytes: int = 4) -> np.ndarray:
+    """Build the length-prefixed, magic-tagged payload read by _bits_to_message."""
+    message_to_embed = STEGO_MAGIC + message
+    message_len_bytes = len(message_to_embed).to_bytes(len_bytes, "big")
+    return np.frombuffer(message_len_bytes + message_to_embed, dtype=np.uint8)
+
+
+def _bits_to_message(bits: np.ndarray, len_bits: int = 32) -> bytes:
+    """Decode a length-prefixed, magic-tagged payload from an array of 0/1 bits."""
+    if bits.size < len_bits:
+        return b""
+    message_len = int.from_bytes(_bits_to_bytes(bits[:len_bits]), "big")
+
+    max_len = (bits.size - len_bits) // 8
+    if not (0 < message_len <= max_len):
+        return b""
+
+    extracted_bytes = _bits_to_bytes(bits[len_bits : len_bits + message_len * 8])
+    if extracted_bytes.startswith(STEGO_MAGIC):
+        return extracted_bytes[len(STEGO_MAGIC) :]
+    return b""
+
+
+# Bits handled per block by the NumPy LSB fallback (a multiple of 8)
+_LSB_BLOCK_BITS = 1 << 16
+
+if _HAS_NUMBA:
+    # Serial on purpose: request threads and the frame prefetcher call these
+    # concurrently, and Numba's workqueue threading layer (used when neither
+    # TBB nor OpenMP is present) aborts the process on concurrent parallel
+    # launches. nogil still lets separate calls run side by side.
+
+    @njit(nogil=True, cache=True)
+    def _embed_lsb_kernel(buf, payload, bit_offset):
+        for i in range(buf.size):
+            j = bit_offset + i
+            bit = (payload[j >> 3] >> (7 - (j & 7))) & 1
+            buf[i] = (buf[i] & ~1) | bit
+
+    @njit(nogil=True, cache=True)
+    def _lsb_embed_pcm16_kernel(samples, payload, out, one, scale):
+        # one/scale carry the sample dtype so float32 input is not promoted
+        num_bits = payload.size * 8
+        for i in range(samples.size):
+            x = samples[i]
+            if x > one:
+                x = one
+            elif x < -one:
+                x = -one
+            value = np.int16(x * scale)
+            if i < num_bits:
+                bit = (payload[i >> 3] >> (7 - (i & 7))) & 1
+                value = (value & ~1) | bit
+            out[i] = value
+
+
+def _embed_lsb(buf: np.ndarray, payload: np.ndarray, bit_offset: int = 0) -> None:
+    """Overwrite the LSBs of ``buf`` in place with payload bits from ``bit_offset``."""
+    if _HAS_NUMBA:
+        _embed_lsb_kernel(buf, payload, bit_offset)
+        return
+
+    # Unpack and apply the bits a cache-sized block at a time so the unpacked
+    # bits and the target slice are still hot for the mask-and-set.
+    lsb_mask = ~buf.dtype.type(1)
+    for start in range(0, buf.size, _LSB_BLOCK_BITS):
+        part = buf[start : start + _LSB_BLOCK_BITS]
+        first = bit_offset + start
+        skip = first & 7
+        chunk = payload[first >> 3 : (first + part.size + 7) >> 3]
+        part &= lsb_mask
+        part |= np.unpackbits(chunk)[skip : skip + part.size]
+
 
 # Image LSB
 def hide_message_in_image(
-    image_path: str, message: bytes, technique: str, output_path: Optional[str] = None
+    image_path: Union[str, IO[bytes]],
+    message: bytes,
+    technique: str,
+    output_path: Optional[str] = None,
 ) -> str:
     if technique.lower() == "lsb":
         return lsb_embed_image(image_path, message, output_path)
-    raise ValueError(f"Unsupported image technique: {technique}")
+    raise InvalidInputError(f"Unsupported image technique: {technique}")
 
 
-def extract_message_from_image(image_path: str, technique: str) -> bytes:
+def extract_message_from_image(
+    image_path: Union[str, IO[bytes]], technique: str
+) -> bytes:
     if technique.lower() == "lsb":
         return lsb_extract_image(image_path)
-    raise ValueError(f"Unsupported image technique: {technique}")
+    raise InvalidInputError(f"Unsupported image technique: {technique}")
+
+
+def _open_image(image_path: Union[str, IO[bytes]]) -> Image.Image:
+    """Open and decode a cover image, rejecting uploads Pillow cannot read."""
+    try:
+        img = Image.open(image_path)
+        img.load()
+    except (OSError, Image.DecompressionBombError):
+        raise InvalidInputError("Could not read image file.")
+    return img
 
 
 def lsb_embed_image(
-    image_path: str, message: bytes, output_path: Optional[str] = None
+    image_path: Union[str, IO[bytes]],
+    message: bytes,
+    output_path: Optional[str] = None,
 ) -> str:
-    img = Image.open(image_path)
+    if output_path is None and not isinstance(image_path, str):
+        # File objects carry no name to derive a default output from
+        raise ValueError("output_path is required for file objects")
+
+    img = _open_image(image_path)
     if img.mode not in {"RGB", "RGBA"}:
         img = img.convert("RGBA")
 
-    message_to_embed = STEGO_MAGIC + message
-    # Prepend message length to the message
-    message_len_bytes = len(message_to_embed).to_bytes(4, "big")
-    binary_message = "".join(
-        f"{byte:08b}" for byte in message_len_bytes + message_to_embed
-    )
-
-    pixels = img.load()
-    width, height = img.size
-    idx = 0
-
-    for y in range(height):
-        for x in range(width):
-            if idx >= len(binary_message):
-                break
-            if img.mode == "RGBA":
-                r, g, b, a = pixels[x, y]
-            else:
-                r, g, b = pixels[x, y]
+    payload = _stego_payload(message)
+    num_bits = payload.size * 8
 
-            if idx < len(binary_message):
-                r = (r & ~1) | int(binary_message[idx])
-                idx += 1
-            if idx < len(binary_message):
-                g = (g & ~1) | int(binary_message[idx])
-                idx += 1
-            if idx < len(binary_message):
-                b = (b & ~1) | int(binary_message[idx])
-                idx += 1
-            if idx < len(binary_message) and img.mode == "RGBA":
-                a = (a & ~1) | int(binary_message[idx])
-                idx += 1
+    # (H, W, C) array; its flat view is the channel-interleaved row-major order
+    arr = np.array(img, dtype=np.uint8)
+    flat = arr.reshape(-1)
+    if num_bits > flat.size:
+        raise InvalidInputError("Image too small for LSB payload")
 
-            pixels[x, y] = (r, g, b, a) if img.mode == "RGBA" else (r, g, b)
-        else:
-            continue
-        break
+    _embed_lsb(flat[:num_bits], payload)
 
-    if idx < len(binary_message):
-        raise ValueError("Image too small for LSB payload")
+    img = Image.fromarray(arr)
 
     if output_path is None:
         output_path = "embedded_" + os.path.basename(image_path)
@@ -95,55 +213,30 @@ def lsb_embed_image(
     return output_path
 
 
-def lsb_extract_image(image_path: str) -> bytes:
-    img = Image.open(image_path)
+def lsb_extract_image(image_path: Union[str, IO[bytes]]) -> bytes:
+    img = _open_image(image_path)
     if img.mode not in {"RGB", "RGBA"}:
         img = img.convert("RGBA")
 
-    pixels = img.load()
-    width, height = img.size
-
-    bit_iterator = iter(
-        (pixel_val & 1)
-        for y in range(height)
-        for x in range(width)
-        for pixel_val in pixels[x, y]
-    )
-
-    def read_bits(n):
-        # Helper to read n bits from the iterator
-        return "".join(str(next(bit_iterator)) for _ in range(n))
-
-    try:
-        # Read the 32-bit length prefix
-        len_bits = read_bits(32)
-        message_len = int(len_bits, 2)
-
-        # Sanity check the message length
-        max_len = (width * height * len(img.getbands()) - 32) // 8
-        if not (0 < message_len <= max_len):
-            return b""  # Invalid length, not a stego image
-
-        # Read the message itself
-        message_bits = read_bits(message_len * 8)
-
-        # Convert bit string to bytes
-        extracted_bytes = bytes(
-            int(message_bits[i : i + 8], 2) for i in range(0, len(message_bits), 8)
-        )
-
-        # Check for magic number
-        if extracted_bytes.startswith(STEGO_MAGIC):
-            return extracted_bytes[len(STEGO_MAGIC) :]
-        else:
-            return b""  # Not a valid stego file
-
-    except (StopIteration, ValueError):
-        # If image ends prematurely or bits are not valid int
+    flat = np.asarray(img, dtype=np.uint8).reshape(-1)
+    if flat.size < 32:
         return b""
+    # Mask only the channels that can hold the advertised payload
+    message_len = int.from_bytes(_bits_to_bytes(flat[:32] & 1), "big")
+    return _bits_to_message(flat[: 32 + message_len * 8] & 1)
 
 
 # Audio Part
+def _decode_compressed_audio(path: str) -> Tuple[np.ndarray, int]:
+    """Decode through pydub/ffmpeg to mono float32 samples."""
+    seg = AudioSegment.from_file(path)
+    seg = seg.set_channels(1)
+    # View the decoded PCM directly instead of going through array.array
+    raw = np.frombuffer(seg.raw_data, dtype=seg.array_type)
+    samples = raw.astype(np.float32) / (2**15)
+    return samples, seg.frame_rate
+
+
 def _load_audio_any(path: str) -> Tuple[np.ndarray, int]:
     if not os.path.isfile(path):
         raise FileNotFoundError(path)
@@ -152,15 +245,30 @@ def _load_audio_any(path: str) -> Tuple[np.ndarray, int]:
     if ext in {".mp3", ".m4a", ".aac"}:
         if not _HAS_PYDUB:
             raise RuntimeError("pydub/ffmpeg required for MP3/M4A support")
-        seg = AudioSegment.from_file(path)
-        seg = seg.set_channels(1)
-        samples = np.array(seg.get_array_of_samples(), dtype=np.float32) / (2**15)
-        return samples, seg.frame_rate
+        try:
+            return _decode_compressed_audio(path)
+        except CouldntDecodeError:
+            raise InvalidInputError("Could not read audio file.")
     else:
-        samples, sr = sf.read(path, dtype="float32")
-        if samples.ndim == 2:
-            samples = samples.mean(axis=1)
-        return samples, sr
+        try:
+            info = sf.info(path)
+        except sf.SoundFileError:
+            raise InvalidInputError("Could not read audio file.")
+        if info.channels == 1:
+            return sf.read(path, dtype="float32")
+
+        # Mix down block by block so the full multi-channel array never exists
+        samples = np.empty(info.frames, dtype=np.float32)
+        pos = 0
+        for block in sf.blocks(
+            path, blocksize=1 << 16, dtype="float32", always_2d=True
+        ):
+            end = pos + len(block)
+            if end > samples.size:  # frame count was only an estimate
+                samples.resize(end, refcheck=False)
+            block.mean(axis=1, out=samples[pos:end])
+            pos = end
+        return samples[:pos], info.samplerate
 
 
 def _save_audio_any(path: str, samples: np.ndarray, sr: int) -> None:
@@ -173,55 +281,44 @@ def _lsb_embed(samples: np.ndarray, message: bytes) -> np.ndarray:
     if not np.issubdtype(samples.dtype, np.floating):
         raise TypeError("Input samples for LSB embedding must be float.")
 
-    int16_samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    payload = _stego_payload(message)
+    num_bits = payload.size * 8
 
-    message_to_embed = STEGO_MAGIC + message
-    message_len_bytes = len(message_to_embed).to_bytes(4, "big")
-    bit_stream = "".join(f"{b:08b}" for b in message_len_bytes + message_to_embed)
+    if num_bits > len(samples):
+        raise InvalidInputError("Audio too short for LSB payload")
 
-    if len(bit_stream) > len(int16_samples):
-        raise ValueError("Audio too short for LSB payload")
+    if _HAS_NUMBA:
+        # Quantize and embed in one pass over the samples
+        int16_samples = np.empty(samples.shape, dtype=np.int16)
+        dtype = samples.dtype.type
+        _lsb_embed_pcm16_kernel(
+            samples, payload, int16_samples, dtype(1.0), dtype(32767)
+        )
+        return int16_samples
 
-    for i, bit in enumerate(bit_stream):
-        int16_samples[i] = (int16_samples[i] & ~1) | int(bit)
+    int16_samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    _embed_lsb(int16_samples[:num_bits], payload)
 
     return int16_samples
 
 
-def _lsb_extract(samples: np.ndarray) -> bytes:
-    if not np.issubdtype(samples.dtype, np.floating):
-        raise TypeError("Input samples for LSB extraction must be float.")
-
+def _pcm16_lsbs(samples: np.ndarray) -> np.ndarray:
     # Scale float samples in [-1.0, 1.0) to int16 range [-32768, 32767]
     # soundfile normalizes by 32768, so we multiply to reverse it.
     int16_samples = (samples * 32768.0).astype(np.int16)
+    return (int16_samples & 1).astype(np.uint8)
 
-    # Extract length (32 bits)
-    if len(int16_samples) < 32:
-        return b""
-    len_bits = "".join(str(v & 1) for v in int16_samples[:32])
-    try:
-        message_len = int(len_bits, 2)
-    except ValueError:
-        return b""  # Not a valid binary number
-
-    # Sanity check
-    max_len = (len(int16_samples) - 32) // 8
-    if not (0 < message_len <= max_len):
-        return b""
-
-    # Extract message
-    total_bits_to_extract = message_len * 8
-    if len(int16_samples) < 32 + total_bits_to_extract:
-        return b""
 
-    bits = "".join(str(v & 1) for v in int16_samples[32 : 32 + total_bits_to_extract])
-    extracted_bytes = bytes(int(bits[i : i + 8], 2) for i in range(0, len(bits), 8))
+def _lsb_extract(samples: np.ndarray) -> bytes:
+    if not np.issubdtype(samples.dtype, np.floating):
+        raise TypeError("Input samples for LSB extraction must be float.")
 
-    if extracted_bytes.startswith(STEGO_MAGIC):
-        return extracted_bytes[len(STEGO_MAGIC) :]
-    else:
+    if samples.size < 32:
         return b""
+    # Only the samples covering the advertised payload are converted
+    len_bits = _pcm16_lsbs(samples[:32])
+    message_len = int.from_bytes(_bits_to_bytes(len_bits), "big")
+    return _bits_to_message(_pcm16_lsbs(samples[: 32 + message_len * 8]))
 
 
 # Echo-Hiding
@@ -236,29 +333,45 @@ def _echo_embed(
     delay0 = int(sr * delay0_ms / 1000)
     delay1 = int(sr * delay1_ms / 1000)
 
-    message_to_embed = STEGO_MAGIC + message
-    message_len_bytes = len(message_to_embed).to_bytes(4, "big")
-    bit_stream = "".join(f"{b:08b}" for b in message_len_bytes + message_to_embed)
+    bits = _bytes_to_bits(_stego_payload(message))
 
     block_size = max(delay0, delay1) * 4  # Ensure block is large enough for cepstrum
-    if len(bit_stream) * block_size > len(samples):
-        raise ValueError("Audio too short for EchoHiding payload")
+    if bits.size * block_size > len(samples):
+        raise InvalidInputError("Audio too short for EchoHiding payload")
 
     stego = samples.copy()
-    for i, bit in enumerate(bit_stream):
-        start = i * block_size
-        end = start + block_size
-        if end > len(stego):
-            break
-
-        delay = delay1 if bit == "1" else delay0
-        echo = np.zeros(block_size)
-        echo[delay:] = echo_amp * stego[start : end - delay]
-        stego[start:end] += echo
+    blocks = samples[: bits.size * block_size].reshape(bits.size, block_size)
+    stego_blocks = stego[: bits.size * block_size].reshape(bits.size, block_size)
+
+    # Add the delayed echo to all "0" blocks at once, then all "1" blocks.
+    # The gathered source rows are scaled in place, so each group needs a
+    # single temporary.
+    ones = bits == 1
+    for rows, delay in ((~ones, delay0), (ones, delay1)):
+        echo = blocks[rows, : block_size - delay]
+        echo *= echo_amp
+        stego_blocks[rows, delay:] += echo
 
     return stego
 
 
+def _cepstrum_basis(block_size: int, lags: np.ndarray) -> np.ndarray:
+    """Inverse-DFT rows for *lags*, applied to a log-magnitude rfft spectrum.
+
+    The log spectrum of a real block is real and symmetric, so the real
+    cepstrum at lag q is a cosine sum over the rfft half, with interior
+    bins counted twice.
+    """
+    k = np.arange(block_size // 2 + 1)
+    weights = np.full(k.size, 2.0)
+    weights[0] = 1.0
+    if block_size % 2 == 0:
+        weights[-1] = 1.0
+    return (
+        weights[:, None] * np.cos(2 * np.pi * np.outer(k, lags) / block_size)
+    ) / block_size
+
+
 def _echo_extract(
     samples: np.ndarray, sr: int, delay0_ms: float = 20, delay1_ms: float = 30
 ) -> bytes:
@@ -266,136 +379,93 @@ def _echo_extract(
     delay1 = int(sr * delay1_ms / 1000)
     block_size = max(delay0, delay1) * 4
 
-    bits = []
     num_blocks = len(samples) // block_size
+    if num_blocks == 0:
+        return b""
 
-    for i in range(num_blocks):
-        start = i * block_size
-        end = start + block_size
-        block = samples[start:end]
-
-        # Cepstrum to find echo
-        ceps = np.fft.ifft(np.log(np.abs(np.fft.fft(block)) + 1e-9)).real
-
-        peak0 = np.max(ceps[delay0 - 2 : delay0 + 3])
-        peak1 = np.max(ceps[delay1 - 2 : delay1 + 3])
-
-        if peak1 > peak0:
-            bits.append("1")
-        else:
-            bits.append("0")
-
-    bit_stream = "".join(bits)
+    # Only the cepstrum bins around the two delays are inspected
+    lags = np.r_[delay0 - 2 : delay0 + 3, delay1 - 2 : delay1 + 3]
+    basis = _cepstrum_basis(block_size, lags)
 
-    if len(bit_stream) < 32:
-        return b""
-    len_bits = bit_stream[:32]
-    try:
-        message_len = int(len_bits, 2)
-    except ValueError:
-        return b""
+    # Cepstra of all blocks at once: one batched FFT and one matrix product.
+    # The FFT length must stay block_size (no next_fast_len padding): padding
+    # resamples the spectrum and shifts the cepstral peaks the decoder reads.
+    blocks = samples[: num_blocks * block_size].reshape(num_blocks, block_size)
+    log_mag = np.abs(rfft(blocks, axis=1, workers=-1))
+    log_mag += 1e-9
+    np.log(log_mag, out=log_mag)
+    ceps = log_mag @ basis
 
-    max_len = (len(bit_stream) - 32) // 8
-    if not (0 < message_len <= max_len):
-        return b""
+    # Peak of the five lags around each delay, in a single reduction
+    peaks = ceps.reshape(num_blocks, 2, 5).max(axis=2)
+    bits = (peaks[:, 1] > peaks[:, 0]).astype(np.uint8)
 
-    total_bits_to_extract = message_len * 8
-    if len(bit_stream) < 32 + total_bits_to_extract:
-        return b""
+    return _bits_to_message(bits)
 
-    message_bits = bit_stream[32 : 32 + total_bits_to_extract]
-    extracted_bytes = bytes(
-        int(message_bits[i : i + 8], 2) for i in range(0, len(message_bits), 8)
-    )
 
-    if extracted_bytes.startswith(STEGO_MAGIC):
-        return extracted_bytes[len(STEGO_MAGIC) :]
-    else:
-        return b""
+# Minimum batch size, in samples, before phase coding offloads FFTs to the GPU
+_GPU_FFT_MIN_SAMPLES = 1 << 20
 
 
 def _phase_embed(samples: np.ndarray, sr: int, message: bytes) -> np.ndarray:
-    message_to_embed = STEGO_MAGIC + message
-    message_len_bytes = len(message_to_embed).to_bytes(4, "big")
-    bit_stream = "".join(f"{b:08b}" for b in message_len_bytes + message_to_embed)
+    bits = _bytes_to_bits(_stego_payload(message))
 
     block_size = 2048  # Fixed block size
-    if len(bit_stream) * block_size > len(samples):
-        raise ValueError("Audio too short for PhaseCoding payload")
+    if bits.size * block_size > len(samples):
+        raise InvalidInputError("Audio too short for PhaseCoding payload")
 
     stego = samples.copy()
-    for i, bit in enumerate(bit_stream):
-        start = i * block_size
-        end = start + block_size
-        if end > len(stego):
-            break
-
-        block = stego[start:end]
-        dft = np.fft.rfft(block)
-
-        # Modify phase of a mid-range frequency component
-        freq_idx_to_modify = len(dft) // 4
+    # One row per payload bit, transformed in a single batched call. cuFFT
+    # only pays off once there are enough blocks to amortize the transfers.
+    blocks = stego[: bits.size * block_size].reshape(bits.size, block_size)
+    use_gpu = _HAS_CUPY and blocks.size >= _GPU_FFT_MIN_SAMPLES
+    if use_gpu:
+        xp = cp
+        dft = cp.fft.rfft(cp.asarray(blocks), axis=1)
+    else:
+        xp = np
+        dft = rfft(blocks, axis=1, workers=-1)
 
-        if bit == "1":
-            dft[freq_idx_to_modify] = np.abs(dft[freq_idx_to_modify]) * np.exp(
-                1j * np.pi / 2
-            )
-        else:
-            dft[freq_idx_to_modify] = np.abs(dft[freq_idx_to_modify]) * np.exp(
-                -1j * np.pi / 2
-            )
+    # Modify phase of a mid-range frequency component
+    # A phase of +/-pi/2 is just a rotation of the magnitude onto +/-j
+    freq_idx_to_modify = dft.shape[1] // 4
+    rotation = xp.asarray(np.where(bits == 1, 1j, -1j))
+    dft[:, freq_idx_to_modify] = xp.abs(dft[:, freq_idx_to_modify]) * rotation
 
-        stego[start:end] = np.fft.irfft(dft, n=block_size)
+    if use_gpu:
+        blocks[:] = cp.asnumpy(cp.fft.irfft(dft, n=block_size, axis=1))
+    else:
+        blocks[:] = irfft(dft, n=block_size, axis=1, workers=-1)
 
     return stego
 
 
 def _phase_extract(samples: np.ndarray, sr: int) -> bytes:
     block_size = 2048
-    bits = []
     num_blocks = len(samples) // block_size
-
-    for i in range(num_blocks):
-        start = i * block_size
-        end = start + block_size
-        block = samples[start:end]
-        dft = np.fft.rfft(block)
-
-        freq_idx_to_check = len(dft) // 4
-        angle = np.angle(dft[freq_idx_to_check])
-
-        if angle > 0:
-            bits.append("1")
-        else:
-            bits.append("0")
-
-    bit_stream = "".join(bits)
-
-    if len(bit_stream) < 32:
-        return b""
-    len_bits = bit_stream[:32]
-    try:
-        message_len = int(len_bits, 2)
-    except ValueError:
-        return b""
-
-    max_len = (len(bit_stream) - 32) // 8
-    if not (0 < message_len <= max_len):
+    if num_blocks == 0:
         return b""
 
-    total_bits_to_extract = message_len * 8
-    if len(bit_stream) < 32 + total_bits_to_extract:
-        return b""
+    # Only one DFT bin per block is inspected, so evaluate just that bin:
+    # columns are its real and imaginary DFT rows
+    freq_idx_to_check = (block_size // 2 + 1) // 4
+    omega = 2 * np.pi * freq_idx_to_check * np.arange(block_size) / block_size
+    basis = np.stack([np.cos(omega), -np.sin(omega)], axis=1).astype(samples.dtype)
 
-    message_bits = bit_stream[32 : 32 + total_bits_to_extract]
-    extracted_bytes = bytes(
-        int(message_bits[i : i + 8], 2) for i in range(0, len(message_bits), 8)
-    )
+    def read_bits(first: int, last: int) -> np.ndarray:
+        blocks = samples[first * block_size : last * block_size]
+        dft_bin = blocks.reshape(-1, block_size) @ basis
+        return (np.arctan2(dft_bin[:, 1], dft_bin[:, 0]) > 0).astype(np.uint8)
 
-    if extracted_bytes.startswith(STEGO_MAGIC):
-        return extracted_bytes[len(STEGO_MAGIC) :]
-    else:
+    # Decode the length prefix first, then only the blocks carrying the payload
+    len_bits = read_bits(0, min(num_blocks, 32))
+    if len_bits.size < 32:
         return b""
+    message_len = int.from_bytes(_bits_to_bytes(len_bits), "big")
+    last = min(num_blocks, 32 + message_len * 8)
+    bits = np.concatenate([len_bits, read_bits(32, last)])
+
+    return _bits_to_message(bits)
 
 
 # Public audio wrappers
@@ -404,31 +474,21 @@ def hide_message_in_audio(
 ) -> str:
     samples, sr = _load_audio_any(audio_path)
     if technique.lower() == "lsb":
-        stego_int16 = _lsb_embed(samples, message)
-        # Convert back to float for saving
-        stego = stego_int16.astype(np.float32) / 32768.0
+        # int16 samples are written to PCM_16 as-is, no float round trip
+        stego = _lsb_embed(samples, message)
     elif technique.lower() == "echohiding":
         stego = _echo_embed(samples, sr, message)
     elif technique.lower() == "phasecoding":
         stego = _phase_embed(samples, sr, message)
     else:
-        raise NotImplementedError(f"Audio technique '{technique}' not implemented.")
+        raise InvalidInputError(f"Unsupported audio technique: {technique}")
 
     if stego.shape[0] < samples.shape[0]:
         stego = np.pad(stego, (0, samples.shape[0] - stego.shape[0]))
 
-    tmp_dir = "/tmp/"
-
-    if not os.path.exists(tmp_dir):
-        os.makedirs(tmp_dir)
-
     if output_path is None:
-        output_path = (
-            tmp_dir
-            + "embedded_"
-            + os.path.splitext(os.path.basename(audio_path))[0]
-            + ".wav"
-        )
+        base = os.path.splitext(os.path.basename(audio_path))[0]
+        output_path = os.path.join(tempfile.gettempdir(), f"embedded_{base}.wav")
     _save_audio_any(output_path, stego, sr)
     return output_path
 
@@ -442,119 +502,241 @@ def extract_message_from_audio(audio_path: str, technique: str) -> bytes:
     elif technique.lower() == "phasecoding":
         return _phase_extract(samples, sr)
     else:
-        raise NotImplementedError(f"Audio technique '{technique}' not implemented.")
+        raise InvalidInputError(f"Unsupported audio technique: {technique}")
 
 
 # Video LSB helpers
-def _video_lsb_embed(frames: list[np.ndarray], message: bytes) -> list[np.ndarray]:
-    if not frames:
-        raise ValueError("Input frame list is empty.")
-    message_to_embed = STEGO_MAGIC + message
-    message_len_bytes = len(message_to_embed).to_bytes(8, "big")
-    bit_stream = "".join(f"{byte:08b}" for byte in message_len_bytes + message_to_embed)
+def _iter_rgb_frames(cap: cv2.VideoCapture) -> Iterator[np.ndarray]:
+    """Decode frames lazily so only one frame is held in memory at a time."""
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        # Convert in place; each read returns a fresh buffer
+        yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
 
-    bits_to_embed = np.array([int(b) for b in bit_stream], dtype=np.uint8)
-    num_bits_to_embed = len(bits_to_embed)
 
-    total_pixels = sum(frame.size for frame in frames)
-    if num_bits_to_embed > total_pixels:
-        raise ValueError("Video too short for LSB payload")
+def _iter_rgb_frames_av(video_path: str) -> Iterator[np.ndarray]:
+    """Decode frames with PyAV: threaded decoding straight to RGB, no BGR pass."""
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        for frame in container.decode(stream):
+            yield frame.to_ndarray(format="rgb24")
+
+
+def _rgb_frames(video_path: str, cap: cv2.VideoCapture) -> Iterator[np.ndarray]:
+    if _HAS_AV:
+        return _iter_rgb_frames_av(video_path)
+    return _iter_rgb_frames(cap)
+
+
+def _video_lsb_embed_frame(
+    frame: np.ndarray, payload: np.ndarray, bit_idx: int
+) -> int:
+    """Embed the next payload bits into ``frame`` in place; returns bits written."""
+    flat_frame = frame.reshape(-1)
+    embed_len = min(flat_frame.size, payload.size * 8 - bit_idx)
+    _embed_lsb(flat_frame[:embed_len], payload, bit_idx)
+    return embed_len
+
+
+def _video_lsb_embed(
+    frames: Iterable[np.ndarray], message: bytes
+) -> Iterator[np.ndarray]:
+    payload = _stego_payload(message, len_bytes=8)
+    num_bits_to_embed = payload.size * 8
 
-    out_frames = []
     bit_idx = 0
+    num_frames = 0
     for frame in frames:
+        num_frames += 1
         if bit_idx >= num_bits_to_embed:
-            out_frames.append(frame)
+            yield frame
             continue
 
-        frame_copy = frame.copy()
-        flat_frame = frame_copy.ravel()
+        # Frames are modified in place so each one stays cache-resident
+        # from decode through embed to encode.
+        frame = np.ascontiguousarray(frame)
+        bit_idx += _video_lsb_embed_frame(frame, payload, bit_idx)
 
-        embed_len = min(len(flat_frame), num_bits_to_embed - bit_idx)
-        flat_frame[:embed_len] = (flat_frame[:embed_len] & 0xFE) | bits_to_embed[
-            bit_idx : bit_idx + embed_len
-        ]
-        bit_idx += embed_len
+        yield frame
 
-        out_frames.append(frame_copy)
+    if num_frames == 0:
+        raise InvalidInputError("Input frame list is empty.")
+    if bit_idx < num_bits_to_embed:
+        raise InvalidInputError("Video too short for LSB payload")
 
-    return out_frames
 
+# CAP_PROP_FRAME_COUNT is exact for most MP4/AVI files but only a
+# duration-based estimate (or 0) for streams such as WebM/MKV, so capacity
+# derived from it is trusted only with this much headroom
+_FRAME_COUNT_SLACK = 1.25
 
-def _video_lsb_extract(frames: list[np.ndarray]) -> bytes:
-    if not frames:
-        return b""
 
-    # Create a generator that yields the LSB of each pixel value sequentially
-    pixel_iterator = (p & 1 for frame in frames for p in frame.ravel())
+def _video_lsb_capacity_hint(cap: cv2.VideoCapture) -> Optional[int]:
+    """Approximate LSB capacity in bits, or None when the frame count is unknown."""
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if frame_count <= 0:
+        return None
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    return int(frame_count * width * height * 3 * _FRAME_COUNT_SLACK)
 
-    def read_bits(n):
-        bits = []
-        try:
-            for _ in range(n):
-                bits.append(str(next(pixel_iterator)))
-        except StopIteration:
-            return None  # Not enough bits in the video
-        return "".join(bits)
-
-    # 1. Read the 8-byte (64-bit) length prefix
-    len_bits_str = read_bits(64)
-    if len_bits_str is None:
-        return b""
 
-    try:
-        message_len = int(len_bits_str, 2)
-    except ValueError:
-        return b""  # Invalid binary format for length
+def _video_lsb_extract(
+    frames: Iterable[np.ndarray], capacity_hint: Optional[int] = None
+) -> bytes:
+    # Room for the 64-bit length prefix; grown as frames actually arrive, so a
+    # garbage length never triggers one huge allocation
+    bits = np.empty(64, dtype=np.uint8)
+    needed = 64
+    filled = 0
+
+    # Copy LSBs into the buffer and stop decoding frames as soon as the
+    # payload is complete.
+    for frame in frames:
+        flat = frame.ravel()
+        pos = 0
+        while filled < needed and pos < flat.size:
+            take = min(needed - filled, flat.size - pos)
+            if filled + take > bits.size:
+                size = min(needed, max(2 * bits.size, filled + take))
+                grown = np.empty(size, dtype=np.uint8)
+                grown[:filled] = bits[:filled]
+                bits = grown
+            np.bitwise_and(
+                flat[pos : pos + take], 1, out=bits[filled : filled + take]
+            )
+            filled += take
+            pos += take
 
-    # 2. Sanity-check the message length against the total available pixels
-    total_pixels = sum(f.size for f in frames)
-    max_len = (total_pixels - 64) // 8
-    if not (0 < message_len <= max_len):
-        return b""  # Length is unreasonable
+            if filled == needed == 64:
+                message_len = int.from_bytes(_bits_to_bytes(bits), "big")
+                if message_len <= 0:
+                    return b""
+                needed = 64 + message_len * 8
+                if capacity_hint is not None and needed > capacity_hint:
+                    return b""  # Length cannot fit even a generous estimate
 
-    # 3. Read the message itself
-    message_bits_str = read_bits(message_len * 8)
-    if message_bits_str is None:
-        return b""  # Video ended before the full message could be read
+        if filled == needed > 64:
+            return _bits_to_message(bits[:needed], len_bits=64)
 
-    # 4. Convert the bit string to bytes
+    return b""  # Video ended before the full message could be read
+
+
+# Motion-Vector helpers
+_MV_FEATURE_PARAMS = dict(maxCorners=100, qualityLevel=0.3, minDistance=7, blockSize=7)
+_MV_LK_PARAMS = dict(
+    winSize=(15, 15),
+    maxLevel=2,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
+)
+
+
+def _cv2_has_cuda() -> bool:
     try:
-        extracted_bytes = bytes(
-            int(message_bits_str[i : i + 8], 2)
-            for i in range(0, len(message_bits_str), 8)
-        )
-    except ValueError:
-        return b""  # Invalid binary format for message bytes
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
 
-    # 5. Check for the magic number and return the payload
-    if extracted_bytes.startswith(STEGO_MAGIC):
-        return extracted_bytes[len(STEGO_MAGIC) :]
 
-    return b""
+_HAS_CV2_CUDA = _cv2_has_cuda()
 
 
+# Corners are re-detected on this cadence, or when too few survive tracking
+_MV_REDETECT_INTERVAL = 10
+_MV_MIN_TRACKED = 10
 
 
-# Motion-Vector helpers
-def _video_mv_embed(cap: cv2.VideoCapture, message: bytes) -> list[np.ndarray]:
-    bit_str = "".join(f"{b:08b}" for b in message) + "1" * 8
-    bits_to_embed = [int(b) for b in bit_str]
+class _MotionTracker:
+    """Sparse Lucas-Kanade tracking between consecutive grayscale frames.
 
-    frames = []
-    ret, prev = cap.read()
-    if not ret:
-        raise ValueError("Empty video")
+    Tracked corners are carried over to the next frame instead of running
+    Shi-Tomasi detection on every pair. Runs on the GPU when OpenCV is built
+    with CUDA, keeping the previous frame resident on the device; otherwise
+    uses the CPU implementation.
+    """
+
+    def __init__(self, first_gray: np.ndarray):
+        self._points: Optional[np.ndarray] = None
+        self._frame_idx = 0
+        if _HAS_CV2_CUDA:
+            self._detector = cv2.cuda.createGoodFeaturesToTrackDetector(
+                cv2.CV_8UC1, **_MV_FEATURE_PARAMS
+            )
+            self._lk = cv2.cuda.SparsePyrLKOpticalFlow_create(
+                winSize=_MV_LK_PARAMS["winSize"],
+                maxLevel=_MV_LK_PARAMS["maxLevel"],
+                iters=_MV_LK_PARAMS["criteria"][1],
+            )
+            self._prev = cv2.cuda_GpuMat()
+            self._next = cv2.cuda_GpuMat()
+            self._prev.upload(first_gray)
+        else:
+            self._prev = first_gray
+
+    def _needs_detection(self) -> bool:
+        due = self._frame_idx % _MV_REDETECT_INTERVAL == 0
+        self._frame_idx += 1
+        return due or self._points is None or len(self._points) < _MV_MIN_TRACKED
+
+    def track(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        """Return the successfully tracked points from the previous frame, or None."""
+        if _HAS_CV2_CUDA:
+            good_new = self._track_cuda(gray)
+        else:
+            good_new = self._track_cpu(gray)
+
+        # Surviving points seed the next frame
+        if good_new is not None and len(good_new) > 0:
+            self._points = good_new.reshape(-1, 1, 2)
+        else:
+            self._points = None
+        return good_new
+
+    def _track_cpu(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        p0 = self._points
+        if self._needs_detection():
+            p0 = cv2.goodFeaturesToTrack(self._prev, mask=None, **_MV_FEATURE_PARAMS)
+        prev_gray, self._prev = self._prev, gray
+        if p0 is None or len(p0) == 0:
+            return None
+
+        p1, st, _ = cv2.calcOpticalFlowPyrLK(
+            prev_gray, gray, p0, None, **_MV_LK_PARAMS
+        )
+        if p1 is None or st is None:
+            return None
+        return p1[st == 1]
+
+    def _track_cuda(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        self._next.upload(gray)
+        if self._needs_detection():
+            p0 = self._detector.detect(self._prev)
+        else:
+            p0 = cv2.cuda_GpuMat(self._points.reshape(1, -1, 2))
+        good_new = None
+        if not p0.empty():
+            p1, st, _ = self._lk.calc(self._prev, self._next, p0, None)
+            if p1 is not None and st is not None:
+                # Only the small point/status arrays come back to the host
+                p1 = p1.download().reshape(-1, 1, 2)
+                st = st.download().reshape(-1, 1)
+                good_new = p1[st == 1]
+        self._prev, self._next = self._next, self._prev
+        return good_new
 
-    prev_gray = cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY)
 
-    feature_params = dict(maxCorners=100, qualityLevel=0.3, minDistance=7, blockSize=7)
+def _video_mv_embed(cap: cv2.VideoCapture, message: bytes) -> Iterator[np.ndarray]:
+    # Message bits followed by the eight-ones terminator
+    bits_to_embed = _bytes_to_bits(message + b"\xff")
+
+    ret, prev = cap.read()
+    if not ret:
+        raise InvalidInputError("Empty video")
 
-    lk_params = dict(
-        winSize=(15, 15),
-        maxLevel=2,
-        criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
-    )
+    tracker = _MotionTracker(cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY))
 
     idx = 0
     while True:
@@ -562,164 +744,194 @@ def _video_mv_embed(cap: cv2.VideoCapture, message: bytes) -> list[np.ndarray]:
         if not ret:
             break
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        p0 = cv2.goodFeaturesToTrack(prev_gray, mask=None, **feature_params)
-
-        if p0 is not None and len(p0) > 0:
-            p1, st, err = cv2.calcOpticalFlowPyrLK(
-                prev_gray, gray, p0, None, **lk_params
-            )
-
-            if p1 is not None and st is not None:
-                good_new = p1[st == 1]
-                if len(good_new) > 0 and idx < len(bits_to_embed):
-                    idx += 1
+        good_new = tracker.track(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        if good_new is not None:
+            if len(good_new) > 0 and idx < len(bits_to_embed):
+                idx += 1
 
-        frames.append(frame)
-        prev_gray = gray
+        yield frame
 
     if idx < len(bits_to_embed):
-        raise ValueError("Video too short for MotionVector payload")
-    return frames
+        raise InvalidInputError("Video too short for MotionVector payload")
 
 
 def _video_mv_extract(cap: cv2.VideoCapture) -> bytes:
-    bits = []
+    # One byte per bit so the buffer can be packed without a copy
+    bits = bytearray()
     ret, prev = cap.read()
     if not ret:
         return b""
 
-    prev_gray = cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY)
-
-    feature_params = dict(maxCorners=100, qualityLevel=0.3, minDistance=7, blockSize=7)
+    tracker = _MotionTracker(cv2.cvtColor(prev, cv2.COLOR_BGR2GRAY))
 
-    lk_params = dict(
-        winSize=(15, 15),
-        maxLevel=2,
-        criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
-    )
-
-    while True:
+    # The message is terminated by the first run of eight set bits. Track the
+    # current run while collecting, so decoding stops right at the terminator.
+    run = 0
+    while run < 8:
         ret, frame = cap.read()
         if not ret:
-            break
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        p0 = cv2.goodFeaturesToTrack(prev_gray, mask=None, **feature_params)
+            return b""
 
-        if p0 is not None and len(p0) > 0:
-            p1, st, err = cv2.calcOpticalFlowPyrLK(
-                prev_gray, gray, p0, None, **lk_params
-            )
+        good_new = tracker.track(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        if good_new is not None:
+            if len(good_new) > 0:
+                bit = bool(good_new[0, 0] >= 0)
+                bits.append(bit)
+                run = run + 1 if bit else 0
 
-            if p1 is not None and st is not None:
-                good_new = p1[st == 1]
-                if len(good_new) > 0:
-                    if good_new[0, 0, 0] >= 0:
-                        bits.append(1)
-                    else:
-                        bits.append(0)
+    return _bits_to_bytes(np.frombuffer(bits, dtype=np.uint8)[:-8])
 
-        prev_gray = gray
 
-    bit_str = "".join(map(str, bits))
-    delim = bit_str.find("1" * 8)
-    if delim == -1:
-        return b""
-    message_bits_str = bit_str[:delim]
-    if len(message_bits_str) % 8:
-        message_bits_str = message_bits_str[: -(len(message_bits_str) % 8)]
-    return bytes(
-        int(message_bits_str[i : i + 8], 2) for i in range(0, len(message_bits_str), 8)
-    )
+# Public video wrappers
+def _mux_source_audio(video_path: str, source_path: str, output_path: str) -> None:
+    """Combine the encoded video with the source's first audio track, if any.
+
+    Both streams are copied rather than re-encoded; AAC is only used when the
+    source audio codec cannot be stored in the output container.
+    """
+    cmd = [
+        FFMPEG_BINARY,
+        "-y",
+        "-i",
+        video_path,
+        "-i",
+        source_path,
+        "-map",
+        "0:v:0",
+        "-map",
+        "1:a:0?",
+        "-c:v",
+        "copy",
+    ]
+    try:
+        subprocess_call(cmd + ["-c:a", "copy", output_path], logger=None)
+    except IOError:
+        subprocess_call(cmd + ["-c:a", "aac", output_path], logger=None)
+
+
+def _prefetch(items: Iterable[np.ndarray], depth: int = 32) -> Iterator[np.ndarray]:
+    """Produce *items* on a background thread, buffering up to *depth* of them.
+
+    Lets decoding and embedding of upcoming frames overlap with encoding of the
+    current one; cv2, NumPy and the ffmpeg pipe all release the GIL.
+    """
+    queue: Queue = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce() -> None:
+        try:
+            for item in items:
+                queue.put((True, item))
+                if stop.is_set():
+                    return
+        except BaseException as exc:
+            queue.put((False, exc))
+        else:
+            queue.put((False, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, value = queue.get()
+            if ok:
+                yield value
+            elif value is not None:
+                raise value
+            else:
+                return
+    finally:
+        # Unblock a producer waiting on a full queue, then wait for it so the
+        # caller can safely release the capture
+        stop.set()
+        while thread.is_alive():
+            try:
+                queue.get_nowait()
+            except Empty:
+                thread.join(0.01)
+
+
+def _write_stego_video(
+    frames: Iterable[np.ndarray],
+    source_path: str,
+    output_path: str,
+    size: Tuple[int, int],
+    fps: float,
+) -> None:
+    """Encode RGB frames as they arrive, then attach the source audio."""
+    video_only_path = os.path.splitext(output_path)[0] + "_video.mp4"
+    writer = FFMPEG_VideoWriter(video_only_path, size, fps, codec="libx264")
+    try:
+        try:
+            for frame in frames:
+                writer.write_frame(frame)
+        finally:
+            writer.close()
+        _mux_source_audio(video_only_path, source_path, output_path)
+    finally:
+        if os.path.exists(video_only_path):
+            os.remove(video_only_path)
 
 
-# Public video wrappers
 def hide_message_in_video(
     video_path: str, message: bytes, technique: str, output_path: Optional[str] = None
 ) -> str:
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
-        raise ValueError("Could not open video file.")
+        raise InvalidInputError("Could not open video file.")
 
-    original_clip = None
-    final_clip = None
     try:
-        if technique.lower() == "lsb":
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frames = []
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-
-            if not frames:
-                raise ValueError("Could not read any frames from the video.")
-
-            new_frames = _video_lsb_embed(frames, message)
-
-            if output_path is None:
-                base = os.path.splitext(os.path.basename(video_path))[0]
-                output_path = f"/tmp/embedded_{base}.mp4"
-
-            final_clip = ImageSequenceClip(new_frames, fps=fps)
-
-            original_clip = VideoFileClip(video_path)
-            if original_clip.audio:
-                final_clip.audio = original_clip.audio
-
-            final_clip.write_videofile(
-                output_path, codec="libx264", audio_codec="aac", logger=None
-            )
-            return output_path
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        size = (
+            int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        )
+        if output_path is None:
+            base = os.path.splitext(os.path.basename(video_path))[0]
+            output_path = os.path.join(tempfile.gettempdir(), f"embedded_{base}.mp4")
 
+        # Frames are decoded, embedded and encoded one at a time instead of
+        # materializing the whole video in memory.
+        if technique.lower() == "lsb":
+            # Fail before decoding and encoding anything when the payload
+            # clearly cannot fit; the exact check still runs after the last frame
+            capacity = _video_lsb_capacity_hint(cap)
+            payload_bits = _stego_payload(message, len_bytes=8).size * 8
+            if capacity is not None and payload_bits > capacity:
+                raise InvalidInputError("Video too short for LSB payload")
+            frames = _video_lsb_embed(_rgb_frames(video_path, cap), message)
         elif technique.lower() == "motionvector":
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            new_frames_bgr = _video_mv_embed(cap, message)
-            new_frames_rgb = [
-                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in new_frames_bgr
-            ]
-
-            if output_path is None:
-                base = os.path.splitext(os.path.basename(video_path))[0]
-                output_path = f"/tmp/embedded_{base}.mp4"
-            final_clip = ImageSequenceClip(new_frames_rgb, fps=fps)
-            original_clip = VideoFileClip(video_path)
-            if original_clip.audio:
-                final_clip.audio = original_clip.audio
-            final_clip.write_videofile(
-                output_path, codec="libx264", audio_codec="aac", logger=None
+            frames = (
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+                for frame in _video_mv_embed(cap, message)
             )
-            return output_path
         else:
-            raise NotImplementedError(f"Video technique '{technique}' not implemented.")
+            raise InvalidInputError(f"Unsupported video technique: {technique}")
+
+        # Close the prefetcher deterministically so its thread has stopped
+        # reading from cap before the finally below releases it
+        with closing(_prefetch(frames)) as prefetched:
+            _write_stego_video(prefetched, video_path, output_path, size, fps)
+        return output_path
     finally:
         cap.release()
-        if original_clip:
-            original_clip.close()
-        if final_clip:
-            final_clip.close()
 
 
 def extract_message_from_video(video_path: str, technique: str) -> bytes:
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
-        raise ValueError("Could not open video file.")
+        raise InvalidInputError("Could not open video file.")
     try:
         if technique.lower() == "lsb":
-            frames = []
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            if not frames:
-                return b""
-            return _video_lsb_extract(frames)
+            # The hint rejects garbage length prefixes without decoding the
+            # whole video; without a frame count the decoded frames decide
+            return _video_lsb_extract(
+                _rgb_frames(video_path, cap), _video_lsb_capacity_hint(cap)
+            )
         elif technique.lower() == "motionvector":
             return _video_mv_extract(cap)
         else:
-            raise NotImplementedError(f"Video technique '{technique}' not implemented.")
+            raise InvalidInputError(f"Unsupported video technique: {technique}")
     finally:
         if cap.isOpened():
             cap.release()
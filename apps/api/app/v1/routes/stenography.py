@@ -1,10 +1,14 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Request
-import uuid
-from fastapi.responses import FileResponse
-from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, HTTPException, Request, Response
+import hashlib
+import itertools
+import time
+from fastapi.staticfiles import StaticFiles
+from typing import IO, Dict, Tuple, Union
 from app.logging_config import logger
 from app.v1.core.encryption import encrypt_data, decrypt_data
+from app.v1.core.errors import InvalidInputError
 from app.v1.core.stenography import (
+    IMPLEMENTED_TECHNIQUES,
     hide_message_in_image,
     extract_message_from_image,
     hide_message_in_audio,
@@ -12,15 +16,21 @@ from app.v1.core.stenography import (
     hide_message_in_video,
     extract_message_from_video,
 )
-from fastapi.responses import FileResponse
-import mimetypes
-import json
+import asyncio
+import base64
 import os
+import secrets
+import tempfile
+from pathlib import PurePosixPath
 
 from app.logging_config import setup_logging  # triggers the single setup
 import logging
 
-import base64
+import aiofiles
+import msgpack
+import orjson
+from streaming_form_data import ParseFailedException, StreamingFormDataParser
+from streaming_form_data.targets import BaseTarget, ValueTarget
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +52,11 @@ SUPPORTED_ENCRYPTION_ALGORITHMS = [
     "XOR",
 ]
 
+# Upper-cased once so per-request validation is a hashed lookup
+_ENCRYPTION_ALGORITHM_SET = frozenset(
+    algo.upper() for algo in SUPPORTED_ENCRYPTION_ALGORITHMS
+)
+
 SUPPORTED_HASH_ALGORITHMS = [
     "keccak",
     "SHA1",
@@ -104,196 +119,407 @@ SUPPORTED_STEGANOGRAPHY_TECHNIQUES = {
 }
 
 
-@router.get("/supported")
-async def get_supported_methods() -> Dict[str, Any]:
+# (media kind, lower-cased technique) pairs, checked before any heavy work.
+# Built from what the embedders implement, not from the advertised list above,
+# which also names image DCT/DWT.
+_TECHNIQUES = frozenset(
+    (kind, technique)
+    for kind, techniques in IMPLEMENTED_TECHNIQUES.items()
+    for technique in techniques
+)
+
+
+def _check_technique(kind: str, technique: str) -> None:
+    if (kind, technique.lower()) not in _TECHNIQUES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported technique for {kind}: {technique}",
+        )
+
+
+# Top-level MIME type -> (embed function, output suffix) and extract function
+_EMBEDDERS = {
+    "image": (hide_message_in_image, ".png"),
+    "audio": (hide_message_in_audio, ".wav"),
+    "video": (hide_message_in_video, ".mp4"),
+}
+_EXTRACTORS = {
+    "image": extract_message_from_image,
+    "audio": extract_message_from_audio,
+    "video": extract_message_from_video,
+}
+
+# Uploads and stego outputs live here; point it at a tmpfs mount if wanted
+TEMP_DIR = os.environ.get(
+    "INSCRYPT_TEMP_DIR", os.path.join(tempfile.gettempdir(), "inscrypt")
+)
+# Uploads and half-written outputs stay in SCRATCH_DIR, which is never served;
+# only finished outputs are renamed into OUTPUT_DIR, the download mount. Both
+# sit under TEMP_DIR so that rename stays on one filesystem.
+SCRATCH_DIR = os.path.join(TEMP_DIR, "scratch")
+OUTPUT_DIR = os.path.join(TEMP_DIR, "outputs")
+os.makedirs(SCRATCH_DIR, exist_ok=True)
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# Whole request bodies above this are refused with 413 before or while streaming
+MAX_UPLOAD_BYTES = int(os.environ.get("INSCRYPT_MAX_UPLOAD_BYTES", 512 << 20))
+
+# Cheap unique names: the pid keeps workers apart, the counter keeps requests
+# apart, and the start time keeps restarts from reusing old names
+_file_ids = itertools.count(time.time_ns() // 1000)
+
+# Image uploads up to this size stay in memory; larger ones roll over to disk
+_SPOOL_MAX_SIZE = 64 << 20
+
+
+def _unique_name(prefix: str, suffix: str) -> str:
+    return os.path.join(
+        SCRATCH_DIR, f"{prefix}_{os.getpid():x}_{next(_file_ids):x}{suffix}"
+    )
+
+
+def _safe_filename(filename: str) -> str:
+    """Strips any client-supplied directories, including Windows-style ones."""
+    return PurePosixPath(filename.replace("\\", "/")).name or "upload"
+
+
+class _UploadTarget(BaseTarget):
     """
-    Returns a list of supported encryption algorithms, hash functions, and steganography techniques.
+    Receives the ``file`` part of an upload.
+
+    Pillow decodes straight from a file object, so images are kept in a
+    SpooledTemporaryFile. The audio and video loaders need a real path, so
+    those parts are streamed to disk with aiofiles instead.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.source: Union[str, IO[bytes], None] = None
+        self._fd = None
+
+    async def on_data_received_async(self, chunk: bytes):
+        if self.source is None:
+            # The part's Content-Type is only known once its body starts arriving
+            if (self.multipart_content_type or "").startswith("image/"):
+                self.source = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+            else:
+                # Keep the original name as a suffix; loaders dispatch on it
+                name = _safe_filename(self.multipart_filename or "")
+                self.source = _unique_name("temp", f"_{name}")
+                self._fd = await aiofiles.open(self.source, "wb")
+        if self._fd is not None:
+            await self._fd.write(chunk)
+        else:
+            self.source.write(chunk)
+
+    async def on_finish_async(self):
+        if self.source is None:
+            # Empty upload: no body chunk ever arrived
+            self.source = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+        if self._fd is not None:
+            await self._fd.close()
+            self._fd = None
+        else:
+            self.source.seek(0)
+
+    async def discard(self):
+        if self._fd is not None:
+            await self._fd.close()
+            self._fd = None
+        await _discard_upload(self.source)
+
+
+async def _discard_upload(source: Union[str, IO[bytes], None]):
+    if isinstance(source, str):
+        if os.path.exists(source):
+            await asyncio.to_thread(os.remove, source)
+    elif source is not None:
+        source.close()
+
+
+async def _receive_upload(
+    request: Request, field_names: Tuple[str, ...]
+) -> Tuple[Union[str, IO[bytes]], str, str, Dict[str, str]]:
+    """
+    Streams a multipart upload without buffering it as an UploadFile.
+
+    The body is parsed chunk by chunk as it arrives. Returns the upload source
+    (a spooled file object for images, a temp file path otherwise), the
+    client's filename, its content type and the decoded form fields.
     """
-    return {
+    too_large = HTTPException(status_code=413, detail="File too large")
+    # Refuse declared oversize bodies before anything is written
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        if int(content_length) > MAX_UPLOAD_BYTES:
+            raise too_large
+
+    file_target = _UploadTarget()
+    value_targets = {name: ValueTarget() for name in field_names}
+    received = 0
+    try:
+        try:
+            parser = StreamingFormDataParser(headers=request.headers)
+            parser.register("file", file_target)
+            for name, target in value_targets.items():
+                parser.register(name, target)
+            async for chunk in request.stream():
+                # Chunked bodies carry no length, so also count as they arrive
+                received += len(chunk)
+                if received > MAX_UPLOAD_BYTES:
+                    raise too_large
+                await parser.adata_received(chunk)
+        except (ParseFailedException, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Malformed upload: {e}")
+    except BaseException:
+        # Client disconnects and task cancellation included. The cleanup runs
+        # as its own task so a pending cancellation cannot cut it short.
+        await asyncio.shield(asyncio.ensure_future(file_target.discard()))
+        raise
+
+    missing = [name for name, target in value_targets.items() if not target.value]
+    if file_target.multipart_filename is None:
+        missing.insert(0, "file")
+    if missing:
+        await file_target.discard()
+        raise HTTPException(
+            status_code=422,
+            detail=f"Missing form field(s): {', '.join(missing)}",
+        )
+
+    try:
+        fields = {
+            name: target.value.decode("utf-8")
+            for name, target in value_targets.items()
+        }
+    except UnicodeDecodeError:
+        await file_target.discard()
+        raise HTTPException(status_code=400, detail="Form fields must be UTF-8 text")
+    return (
+        file_target.source,
+        _safe_filename(file_target.multipart_filename),
+        file_target.multipart_content_type or "",
+        fields,
+    )
+
+
+# Payloads embedded before the msgpack envelope are a JSON codebook, this
+# delimiter and the base64 ciphertext
+_LEGACY_DELIMITER = b"|~_~|INSCRYPT_DELIMITER|~_~|"
+
+
+def _split_payload(combined_payload: bytes) -> Tuple[bytes, bytes]:
+    """Returns the codebook and ciphertext of a hidden payload in either format."""
+    try:
+        envelope = msgpack.unpackb(combined_payload, raw=False)
+        return envelope["codebook"], envelope["data"]
+    except (ValueError, KeyError, TypeError):
+        if _LEGACY_DELIMITER not in combined_payload:
+            raise
+    codebook, encrypted_data_b64 = combined_payload.split(_LEGACY_DELIMITER, 1)
+    return codebook, base64.b64decode(encrypted_data_b64, validate=True)
+
+
+# The supported lists never change at runtime, so encode them once
+_SUPPORTED_BODY = orjson.dumps(
+    {
         "encryption_algorithms": SUPPORTED_ENCRYPTION_ALGORITHMS,
         "hash_algorithms": SUPPORTED_HASH_ALGORITHMS,
         "steganography_techniques": SUPPORTED_STEGANOGRAPHY_TECHNIQUES,
     }
+)
+_SUPPORTED_DIGEST = hashlib.md5(_SUPPORTED_BODY, usedforsecurity=False).hexdigest()
+_SUPPORTED_ETAG = f'"{_SUPPORTED_DIGEST}"'
+_SUPPORTED_HEADERS = {
+    "ETag": _SUPPORTED_ETAG,
+    "Cache-Control": "public, max-age=3600",
+}
+
+
+@router.get("/supported")
+async def get_supported_methods(request: Request) -> Response:
+    """
+    Returns a list of supported encryption algorithms, hash functions, and steganography techniques.
+    """
+    if request.headers.get("if-none-match") == _SUPPORTED_ETAG:
+        return Response(status_code=304, headers=_SUPPORTED_HEADERS)
+    return Response(
+        _SUPPORTED_BODY, media_type="application/json", headers=_SUPPORTED_HEADERS
+    )
 
 
 @router.post("/embed")
-async def embed_message(
-    request: Request,
-    file: UploadFile = File(...),
-    message: str = Form(...),
-    encryption_algos: str = Form(...),
-    password: str = Form(...),
-    hash_function: str = Form(...),
-    stenographic_technique: str = Form(...),
-):
+async def embed_message(request: Request):
+    # Stream the upload instead of buffering it as an UploadFile
+    source, _, content_type, fields = await _receive_upload(
+        request,
+        (
+            "message",
+            "encryption_algos",
+            "password",
+            "hash_function",
+            "stenographic_technique",
+        ),
+    )
+    message = fields["message"]
+    encryption_algos = fields["encryption_algos"]
+    password = fields["password"]
+    hash_function = fields["hash_function"]
+    stenographic_technique = fields["stenographic_technique"]
     try:
-        # Save the uploaded file temporarily with a unique name
-        temp_dir = "/tmp"
-        os.makedirs(temp_dir, exist_ok=True)
-        unique_filename = f"temp_{uuid.uuid4().hex}_{file.filename}"
-        temp_file_path = os.path.join(temp_dir, unique_filename)
-        with open(temp_file_path, "wb") as f:
-            f.write(file.file.read())
+        # Reject unsupported media before doing any crypto work
+        kind = content_type.split("/", 1)[0]
+        try:
+            hide, output_suffix = _EMBEDDERS[kind]
+        except KeyError:
+            raise HTTPException(status_code=400, detail="Unsupported file type")
+        _check_technique(kind, stenographic_technique)
 
         encryption_layers = [algo.strip() for algo in encryption_algos.split(",")]
 
-        print(encryption_layers)
-
         unsupported_algos = [
             algo
             for algo in encryption_layers
-            if algo.upper() not in SUPPORTED_ENCRYPTION_ALGORITHMS
+            if algo.upper() not in _ENCRYPTION_ALGORITHM_SET
         ]
 
-        print(f"unsupported algorithms: {unsupported_algos}")
-
         if unsupported_algos:
             raise HTTPException(
                 status_code=400,
                 detail=f"Unsupported encryption algorithm(s): {', '.join(unsupported_algos)}",
             )
 
-        encrypted_result = encrypt_data(
+        # Crypto and stego work is blocking; keep it off the event loop
+        encrypted_result = await asyncio.to_thread(
+            encrypt_data,
             data=message.encode("utf-8"),
             password=password,
             encryption_layers=encryption_layers,
             hash_name=hash_function,
         )
 
-        logger.debug(f"Raw encrypted data: {encrypted_result!r}")
-
-        output_file_name = (
-            f"/tmp/output_{uuid.uuid4().hex}.{file.filename.split('.')[-1]}"
-        )
-
-        # Serialize codebook and combine with encrypted data
-        codebook_json = json.dumps(encrypted_result["codebook"])
-        encrypted_data_b64 = encrypted_result["encrypted_data"]
-
-        # Use a unique, unlikely delimiter
-        delimiter = b"|~_~|INSCRYPT_DELIMITER|~_~|"
+        logger.debug("Raw encrypted data: %r", encrypted_result)
 
-        combined_payload = (
-            codebook_json.encode("utf-8")
-            + delimiter
-            + encrypted_data_b64.encode("utf-8")
+        # Pack the codebook and the encrypted data into one length-framed blob
+        combined_payload = msgpack.packb(
+            {
+                "codebook": encrypted_result["codebook"],
+                "data": encrypted_result["encrypted_data"],
+            },
+            use_bin_type=True,
         )
 
-        logger.debug(f"Combined payload length: {len(combined_payload)}")
+        logger.debug("Combined payload length: %d", len(combined_payload))
 
-        if file.content_type.startswith("image/"):
-            output_path = hide_message_in_image(
-                temp_file_path,
-                combined_payload,
-                stenographic_technique,
-                output_path=output_file_name,
-            )
-        elif file.content_type.startswith("audio/"):
-            output_path = hide_message_in_audio(
-                temp_file_path,
+        # Write under a scratch name and publish with an atomic rename, so a
+        # download can never observe a half-written file
+        partial_path = _unique_name("partial", output_suffix)
+        try:
+            written_path = await asyncio.to_thread(
+                hide,
+                source,
                 combined_payload,
                 stenographic_technique,
+                output_path=partial_path,
             )
-        elif file.content_type.startswith("video/"):
-            output_path = hide_message_in_video(
-                temp_file_path,
-                combined_payload,
-                stenographic_technique,
+            # Published names are random: they are the only download credential
+            output_path = os.path.join(
+                OUTPUT_DIR, f"output_{secrets.token_hex(16)}{output_suffix}"
             )
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type")
-
-        os.remove(temp_file_path)
+            await asyncio.to_thread(os.replace, written_path, output_path)
+        except Exception:
+            await _discard_upload(partial_path)
+            raise
 
         return {
             "output_path": os.path.basename(output_path),
         }
-    except Exception as e:
-        logger.error(f"Error occurred: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    except HTTPException:
+        raise
+    except InvalidInputError as e:
+        # Bad hash names, covers too small for the payload and the like
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        logger.exception("Embedding failed")
+        raise HTTPException(status_code=500, detail="Internal error")
+    finally:
+        await _discard_upload(source)
 
 
 @router.post("/extract")
-async def extract_message(
-    file: UploadFile = File(...),
-    password: str = Form(...),
-    stenographic_technique: str = Form(...),
-):
+async def extract_message(request: Request):
+    # 1. stream uploaded file
+    source, filename, content_type, fields = await _receive_upload(
+        request, ("password", "stenographic_technique")
+    )
+    password = fields["password"]
+    stenographic_technique = fields["stenographic_technique"]
     try:
-        logger.info(f"Received extract request for file: {file.filename}")
-
-        # 1. save uploaded file
-        temp_dir = "/tmp"
-        os.makedirs(temp_dir, exist_ok=True)
-        unique_filename = f"temp_{uuid.uuid4().hex}_{file.filename}"
-        temp_file_path = os.path.join(temp_dir, unique_filename)
-        with open(temp_file_path, "wb") as f:
-            f.write(file.file.read())
+        logger.info("Received extract request for file: %s", filename)
 
         # 2. read steganographically hidden payload
-        if file.content_type.startswith("image/"):
-            combined_payload = extract_message_from_image(
-                temp_file_path, stenographic_technique
-            )
-        elif file.content_type.startswith("audio/"):
-            combined_payload = extract_message_from_audio(
-                temp_file_path, stenographic_technique
-            )
-        elif file.content_type.startswith("video/"):
-            combined_payload = extract_message_from_video(
-                temp_file_path, stenographic_technique
-            )
-        else:
-            logger.error(f"Unsupported file type: {file.content_type}")
+        kind = content_type.split("/", 1)[0]
+        extract = _EXTRACTORS.get(kind)
+        if extract is None:
+            logger.error("Unsupported file type: %s", content_type)
             raise HTTPException(status_code=400, detail="Unsupported file type")
+        _check_technique(kind, stenographic_technique)
+        combined_payload = await asyncio.to_thread(
+            extract, source, stenographic_technique
+        )
 
         logger.info("Payload extracted successfully.")
-        os.remove(temp_file_path)
 
         # 3. Separate codebook and encrypted data
-        delimiter = b"|~_~|INSCRYPT_DELIMITER|~_~|"
-        if delimiter not in combined_payload:
+        try:
+            codebook_bytes, encrypted_data = _split_payload(combined_payload)
+        except (ValueError, KeyError, TypeError):
             logger.error(
-                f"Delimiter not found in payload. Payload length: {len(combined_payload)}"
-            )
-            logger.debug(f"Payload (first 100 bytes): {combined_payload[:100]!r}")
-            raise HTTPException(
-                status_code=400, detail="Invalid payload format: delimiter not found."
+                "Could not unpack payload. Payload length: %d", len(combined_payload)
             )
-
-        codebook_json_bytes, encrypted_data_b64_bytes = combined_payload.split(
-            delimiter, 1
-        )
-        codebook_json = codebook_json_bytes.decode("utf-8")
-
-        try:
-            codebook = json.loads(codebook_json)
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=400, detail="Invalid codebook format.")
+            logger.debug("Payload (first 100 bytes): %r", combined_payload[:100])
+            raise HTTPException(status_code=400, detail="Invalid payload format.")
 
         # 4. decrypt
-        decrypted_message = decrypt_data(
-            encrypted_data=base64.b64decode(encrypted_data_b64_bytes),
+        decrypted_message = await asyncio.to_thread(
+            decrypt_data,
+            encrypted_data=encrypted_data,
             password=password,
-            codebook=codebook,
+            codebook=codebook_bytes,
         )
 
         logger.info("Decryption successful.")
-        return {"message": decrypted_message.decode()}
-    except Exception as e:
-        logger.error("An error occurred during extraction", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@router.get("/download/{file_name}")
-async def download_file(file_name: str):
-    file_path = f"/tmp/{file_name}"
-    print(f"Downloading file: {file_path}")
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    media_type, _ = mimetypes.guess_type(file_path)
-    return FileResponse(
-        file_path,
-        filename=file_name,
-        media_type=media_type or "application/octet-stream",
-    )
+        try:
+            return {"message": decrypted_message.decode()}
+        except UnicodeDecodeError:
+            # Ciphers without a MAC (ARC4, stream ciphers) yield garbage instead
+            raise HTTPException(
+                status_code=400,
+                detail="Decryption failed: wrong password or corrupted data",
+            )
+    except HTTPException:
+        raise
+    except InvalidInputError as e:
+        # Wrong password (MAC check), corrupt payloads, unreadable covers
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        logger.exception("Extraction failed")
+        raise HTTPException(status_code=500, detail="Internal error")
+    finally:
+        await _discard_upload(source)
+
+
+class _DownloadFiles(StaticFiles):
+    """StaticFiles over OUTPUT_DIR that still serves outputs as attachments."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Content-Disposition"] = (
+            f'attachment; filename="{os.path.basename(full_path)}"'
+        )
+        return response
+
+
+# Mounted by the app at /api/v1/download; StaticFiles resolves paths safely
+# and streams the file without a hand-written handler
+downloads = _DownloadFiles(directory=OUTPUT_DIR)
@@ -1,13 +1,58 @@
+import mimetypes
+from contextlib import asynccontextmanager
+from typing import Any
+
+import orjson
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from app.v1.routes import stenography
 from app.logging_config import logger
+from app.v1.core.encryption import HAS_AESNI, HAS_CLMUL
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+DOWNLOAD_PREFIX = "/api/v1/download"
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse that encodes with orjson straight to bytes."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class APIGZipMiddleware:
+    """Gzips JSON API responses but streams stego downloads untouched.
+
+    The downloads are PNG/WAV/MP4 files that do not shrink, so compressing
+    them would only burn CPU.
+    """
 
-app = FastAPI()
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024) -> None:
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
 
-@app.on_event("startup")
-async def startup_event():
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and not scope["path"].startswith(DOWNLOAD_PREFIX):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     logger.info("Starting up Inscrypt API...")
+    # Load the MIME database now rather than on the first download
+    mimetypes.init()
+    logger.info("AES-NI available: %s, CLMUL available: %s", HAS_AESNI, HAS_CLMUL)
+    if not HAS_AESNI:
+        logger.warning("AES layers will run without hardware acceleration")
+    yield
+    logger.info("Shutting down Inscrypt API...")
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,11 +61,36 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(APIGZipMiddleware, minimum_size=1024)
 
 app.include_router(stenography.router, prefix="/api/v1")
+app.mount(DOWNLOAD_PREFIX, stenography.downloads, name="downloads")
 
 
 @app.get("/")
 def read_root():
     logger.info("Root endpoint was hit")
     return {"message": "Welcome to the Inscrypt API"}
+
+
+if __name__ == "__main__":
+    import os
+
+    import uvicorn
+
+    reload = os.environ.get("INSCRYPT_RELOAD", "").lower() in {"1", "true", "yes"}
+    # Stego work is CPU-bound, so production runs one worker per core; uvicorn
+    # cannot combine workers with reload
+    workers = 1 if reload else int(os.environ.get("INSCRYPT_WORKERS", os.cpu_count()))
+    uvicorn.run(
+        "main:app",
+        host=os.environ.get("INSCRYPT_HOST", "0.0.0.0"),
+        port=int(os.environ.get("INSCRYPT_PORT", "8000")),
+        reload=reload,
+        workers=workers,
+        # "auto" resolves to uvloop and httptools, both pulled in by
+        # uvicorn[standard], and falls back cleanly where uvloop is missing
+        loop="auto",
+        http="auto",
+        backlog=2048,
+    )